@@ -1,13 +1,23 @@
+import os
 import sys
+import tempfile
 import time
-from functools import partial
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from functools import partial, lru_cache
+from urllib.parse import quote
 
-from requests import get, post, delete, put
+import requests
+from requests.adapters import HTTPAdapter
 import argparse
+import orjson
 
 from tenacity import retry, stop_after_delay, wait_fixed, retry_if_exception_type, stop_after_attempt
 
 IGNORED_BRANCHES = ["main", "master"]
+JSON_HEADERS = {"Content-Type": "application/json"}
+ID_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".cache", "octopus-featurebranch", "ids.json")
+ID_CACHE_TTL = 60 * 60
+MAX_CONNECTIONS = 8
 
 
 class OctopusApiError(Exception):
@@ -23,6 +33,47 @@ retry_on_communication_error = partial(
 )()
 
 
+class Result:
+    # A placeholder for the value returned by an earlier pipeline step
+    def __init__(self, step):
+        self.step = step
+
+
+class Pipeline:
+    # Runs named steps on a thread pool, starting each step as soon as the steps it depends on have finished.
+    # A step depends on every step whose Result is passed as an argument, and on the steps listed in after.
+    def __init__(self, max_workers=MAX_CONNECTIONS):
+        self.max_workers = max_workers
+        self.steps = {}
+
+    def add(self, name, func, *func_args, after=()):
+        dependencies = set(after) | {a.step for a in func_args if isinstance(a, Result)}
+        self.steps[name] = (func, func_args, dependencies)
+
+    def run(self):
+        results = {}
+        pending = dict(self.steps)
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while len(pending) != 0 or len(running) != 0:
+                ready = [name for name, (_, _, dependencies) in pending.items() if dependencies.issubset(results)]
+                for name in ready:
+                    func, func_args, _ = pending.pop(name)
+                    resolved_args = [results[a.step] if isinstance(a, Result) else a for a in func_args]
+                    running[executor.submit(func, *resolved_args)] = name
+
+                if len(running) == 0:
+                    raise ValueError("The pipeline steps " + ", ".join(pending)
+                                     + " have missing or circular dependencies")
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future)] = future.result()
+
+        return results
+
+
 def is_not_blank(s):
     return bool(s and not s.isspace())
 
@@ -62,28 +113,124 @@ def parse_args():
                         help='Targets assigned to this environment and the role passed in via --targetRole '
                              + 'are (un)assigned to the new environment.',
                         required=False)
+    parser.add_argument('--optimisticCreate', dest='optimistic_create', action='store_true',
+                        help='Create the environment, lifecycle and channel without first checking if they exist, '
+                             + 'falling back to the existing resource if Octopus rejects the duplicate name. '
+                             + 'The channel still reads the deployment process to build its rules before the POST, '
+                             + 'so rerunning against an existing channel takes three requests instead of one.',
+                        required=False)
 
     return parser.parse_args()
 
 
-def build_headers():
-    return {"X-Octopus-ApiKey": args.octopus_api_key}
+def is_duplicate_name_error(response):
+    # Octopus rejects a duplicate name as a validation error, listing a message about the name in its Errors
+    if response.status_code == 409:
+        return True
+    if response.status_code != 400:
+        return False
+
+    try:
+        json = parse_json(response)
+    except orjson.JSONDecodeError:
+        return False
+
+    errors = (json.get("Errors") or []) if isinstance(json, dict) else []
+    messages = [str(a).lower() for a in errors]
+    return any("name" in a and ("already" in a or "unique" in a) for a in messages)
+
+
+def parse_json(response):
+    return orjson.loads(response.content)
+
+
+def load_id_cache():
+    try:
+        with open(ID_CACHE_FILE, "rb") as f:
+            entries = orjson.loads(f.read())
+    except (OSError, orjson.JSONDecodeError):
+        return {}
+
+    if not isinstance(entries, dict):
+        return {}
+
+    # Expired entries and entries written in an older format are dropped
+    now = time.time()
+    return {url: entry for url, entry in entries.items()
+            if isinstance(entry, dict) and {"ETag", "Id", "Timestamp"}.issubset(entry)
+            and now - entry["Timestamp"] <= ID_CACHE_TTL}
+
+
+def save_id_cache():
+    # Write to a temporary file and move it into place, so a concurrent run never reads a partial file
+    try:
+        cache_dir = os.path.dirname(ID_CACHE_FILE)
+        os.makedirs(cache_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile("wb", dir=cache_dir, delete=False) as f:
+            f.write(orjson.dumps(id_cache))
+        os.replace(f.name, ID_CACHE_FILE)
+    except OSError as ex:
+        sys.stderr.write("Failed to save the ID cache: " + str(ex) + "\n")
 
 
+def find_id_by_name(url, name):
+    # The IDs found by earlier runs are revalidated with the list's ETag, so an unchanged list returns
+    # an empty 304 response instead of being downloaded and parsed again
+    cached = id_cache.get(url)
+
+    response = session.get(url, headers={"If-None-Match": cached["ETag"]} if cached is not None else None)
+    if response.status_code == 304:
+        return cached["Id"]
+
+    json = parse_json(response)
+    first_id = next((a["Id"] for a in json["Items"] if a["Name"] == name), None)
+
+    etag = response.headers.get("ETag")
+    if etag is not None:
+        id_cache[url] = {"ETag": etag, "Id": first_id, "Timestamp": time.time()}
+
+    return first_id
+
+
+def get_all_items(url):
+    # Yields the items from every page of a list endpoint by following the Page.Next links
+    while url is not None:
+        response = session.get(url)
+        if not response:
+            raise OctopusApiError
+        json = parse_json(response)
+        yield from json["Items"]
+        next_link = json["Links"].get("Page.Next")
+        url = f"{server_url}{next_link}" if next_link is not None else None
+
+
+def build_session():
+    # A single session keeps connections to the Octopus server alive between API calls
+    new_session = requests.Session()
+    new_session.headers.update({"X-Octopus-ApiKey": args.octopus_api_key})
+    # Blocking on a full pool caps the number of concurrent requests sent to the Octopus server
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_CONNECTIONS, pool_block=True, max_retries=0)
+    new_session.mount("https://", adapter)
+    new_session.mount("http://", adapter)
+    return new_session
+
+
+@lru_cache(maxsize=256)
 def get_space_id(space_name):
     if is_blank(space_name):
         return None
 
-    url = args.octopus_url + "/api/spaces?partialName=" + space_name.strip() + "&take=1000"
-    response = get(url, headers=headers)
-    spaces_json = response.json()
+    # partialName is the only name filter Octopus offers, so exact matches are found client side
+    url = f"{base_url}/spaces?partialName={quote(space_name.strip())}&take=1000"
+    response = session.get(url)
+    spaces_json = parse_json(response)
 
-    filtered_items = [a for a in spaces_json["Items"] if a["Name"] == space_name.strip()]
+    first_id = next((a["Id"] for a in spaces_json["Items"] if a["Name"] == space_name.strip()), None)
 
-    if len(filtered_items) == 0:
+    if first_id is None:
         # Check to see if the space name was actually a space ID
-        url = args.octopus_url + "/api/spaces/" + space_name
-        response = get(url, headers=headers)
+        url = f"{base_url}/spaces/{quote(space_name.strip())}"
+        response = session.get(url)
         if not response:
             sys.stderr.write("The space called " + space_name + " could not be found.\n")
             return None
@@ -91,26 +238,21 @@ def get_space_id(space_name):
         # A valid response means the space name was a valid ID
         return space_name
 
-    first_id = filtered_items[0]["Id"]
     return first_id
 
 
+@lru_cache(maxsize=256)
 def get_resource_id(space_id, resource_type, resource_name):
     if is_blank(space_id) or is_blank(resource_type) or is_blank(resource_name):
         return None
 
-    url = args.octopus_url + "/api/" + space_id + "/" + resource_type + "?partialName=" \
-          + resource_name.strip() + "&take=1000"
-    response = get(url, headers=headers)
-    json = response.json()
-
-    filtered_items = [a for a in json["Items"] if a["Name"] == resource_name.strip()]
-    if len(filtered_items) == 0:
+    url = f"{base_url}/{space_id}/{resource_type}?partialName={quote(resource_name.strip())}&take=1000"
+    first_id = find_id_by_name(url, resource_name.strip())
+    if first_id is None:
         sys.stderr.write("The resource called " + resource_name + " of type " + resource_type
                          + " could not be found in space " + space_id + ".\n")
         return None
 
-    first_id = filtered_items[0]["Id"]
     return first_id
 
 
@@ -118,9 +260,9 @@ def get_resource(space_id, resource_type, resource_id):
     if is_blank(space_id) or is_blank(resource_type) or is_blank(resource_id):
         return None
 
-    url = args.octopus_url + "/api/" + space_id + "/" + resource_type + "/" + resource_id
-    response = get(url, headers=headers)
-    json = response.json()
+    url = f"{base_url}/{space_id}/{resource_type}/{resource_id}"
+    response = session.get(url)
+    json = parse_json(response)
 
     return json
 
@@ -129,20 +271,29 @@ def create_environment(space_id, branch_name):
     if is_blank(space_id) or is_blank(branch_name):
         return None
 
-    environment_id = get_resource_id(space_id, "environments", branch_name)
+    if not args.optimistic_create:
+        environment_id = get_resource_id(space_id, "environments", branch_name)
 
-    if environment_id is not None:
-        sys.stderr.write("Found environment " + environment_id + "\n")
-        return environment_id
+        if environment_id is not None:
+            sys.stderr.write("Found environment " + environment_id + "\n")
+            return environment_id
 
     environment = {
         'Name': branch_name
     }
-    url = args.octopus_url + "/api/" + space_id + "/environments"
-    response = post(url, headers=headers, json=environment)
+    url = f"{base_url}/{space_id}/environments"
+    response = session.post(url, data=orjson.dumps(environment), headers=JSON_HEADERS)
     if not response:
+        if args.optimistic_create and is_duplicate_name_error(response):
+            get_resource_id.cache_clear()
+            environment_id = get_resource_id(space_id, "environments", branch_name)
+            if environment_id is not None:
+                sys.stderr.write("Found environment " + environment_id + "\n")
+                return environment_id
+        sys.stderr.write("Failed to create environment " + branch_name + ": " + response.text + "\n")
         raise OctopusApiError
-    json = response.json()
+    get_resource_id.cache_clear()
+    json = parse_json(response)
     sys.stderr.write("Created environment " + json["Id"] + "\n")
     return json["Id"]
 
@@ -151,11 +302,12 @@ def create_lifecycle(space_id, environment_id, branch_name):
     if is_blank(space_id) or is_blank(environment_id) or is_blank(branch_name):
         return None
 
-    lifecycle_id = get_resource_id(space_id, "lifecycles", branch_name)
+    if not args.optimistic_create:
+        lifecycle_id = get_resource_id(space_id, "lifecycles", branch_name)
 
-    if lifecycle_id is not None:
-        sys.stderr.write("Found lifecycle " + lifecycle_id + "\n")
-        return lifecycle_id
+        if lifecycle_id is not None:
+            sys.stderr.write("Found lifecycle " + lifecycle_id + "\n")
+            return lifecycle_id
 
     lifecycle = {
         'Id': None,
@@ -181,31 +333,35 @@ def create_lifecycle(space_id, environment_id, branch_name):
         'Links': None
     }
 
-    url = args.octopus_url + "/api/" + space_id + "/lifecycles"
-    response = post(url, headers=headers, json=lifecycle)
+    url = f"{base_url}/{space_id}/lifecycles"
+    response = session.post(url, data=orjson.dumps(lifecycle), headers=JSON_HEADERS)
     if not response:
+        if args.optimistic_create and is_duplicate_name_error(response):
+            get_resource_id.cache_clear()
+            lifecycle_id = get_resource_id(space_id, "lifecycles", branch_name)
+            if lifecycle_id is not None:
+                sys.stderr.write("Found lifecycle " + lifecycle_id + "\n")
+                return lifecycle_id
+        sys.stderr.write("Failed to create lifecycle " + branch_name + ": " + response.text + "\n")
         raise OctopusApiError
-    json = response.json()
+    get_resource_id.cache_clear()
+    json = parse_json(response)
     sys.stderr.write("Created lifecycle " + json["Id"] + "\n")
     return json["Id"]
 
 
+@lru_cache(maxsize=256)
 def find_channel(space_id, project_id, branch_name):
     if is_blank(space_id) or is_blank(project_id) or is_blank(branch_name):
         return None
 
-    url = args.octopus_url + "/api/" + space_id + "/projects/" + project_id + "/channels?partialName=" \
-          + branch_name.strip() + "&take=1000"
-    response = get(url, headers=headers)
-    json = response.json()
-
-    filtered_items = [a for a in json["Items"] if a["Name"] == branch_name.strip()]
-    if len(filtered_items) == 0:
+    url = f"{base_url}/{space_id}/projects/{project_id}/channels?partialName={quote(branch_name.strip())}&take=1000"
+    first_id = find_id_by_name(url, branch_name.strip())
+    if first_id is None:
         sys.stderr.write("The resource called " + branch_name + " of type channel could not be found in space "
                          + space_id + ".\n")
         return None
 
-    first_id = filtered_items[0]["Id"]
     return first_id
 
 
@@ -213,13 +369,13 @@ def find_targets(space_id):
     if is_blank(space_id):
         return None
 
-    url = args.octopus_url + "/api/" + space_id + "/machines?take=1000"
-    response = get(url, headers=headers)
+    url = f"{base_url}/{space_id}/machines?take=1000"
+    response = session.get(url)
 
     if not response:
         raise OctopusApiError
 
-    json = response.json()
+    json = parse_json(response)
     return json["Items"]
 
 
@@ -227,13 +383,13 @@ def find_targets_by_role(space_id, role_name):
     if is_blank(space_id) or is_blank(role_name):
         return None
 
-    url = args.octopus_url + "/api/" + space_id + "/machines?take=1000"
-    response = get(url, headers=headers)
+    url = f"{base_url}/{space_id}/machines?take=1000"
+    response = session.get(url)
 
     if not response:
         raise OctopusApiError
 
-    json = response.json()
+    json = parse_json(response)
     return [a for a in json["Items"] if role_name in a["Roles"]]
 
 
@@ -241,11 +397,11 @@ def find_packages(space_id, project_id):
     if is_blank(space_id) or is_blank(project_id):
         return None
 
-    url = args.octopus_url + "/api/" + space_id + "/projects/" + project_id + "/deploymentprocesses"
-    response = get(url, headers=headers)
+    url = f"{base_url}/{space_id}/projects/{project_id}/deploymentprocesses"
+    response = session.get(url)
     if not response:
         raise OctopusApiError
-    json = response.json()
+    json = parse_json(response)
 
     packages = []
 
@@ -262,11 +418,12 @@ def create_channel(space_id, project_id, lifecycle_id, step_name, package_name,
     if is_blank(space_id) or is_blank(project_id) or is_blank(lifecycle_id) or is_blank(branch_name):
         return None
 
-    channel_id = find_channel(space_id, project_id, branch_name)
+    if not args.optimistic_create:
+        channel_id = find_channel(space_id, project_id, branch_name)
 
-    if channel_id is not None:
-        sys.stderr.write("Found channel " + channel_id + "\n")
-        return channel_id
+        if channel_id is not None:
+            sys.stderr.write("Found channel " + channel_id + "\n")
+            return channel_id
 
     packages = find_packages(space_id, project_id) if step_name is None or len(step_name.strip()) == 0 else \
         [{'DeploymentAction': step_name, 'PackageReference': package_name}]
@@ -286,11 +443,19 @@ def create_channel(space_id, project_id, lifecycle_id, step_name, package_name,
         'Rules': rules
     }
 
-    url = args.octopus_url + "/api/" + space_id + "/projects/" + project_id + "/channels"
-    response = post(url, headers=headers, json=channel)
+    url = f"{base_url}/{space_id}/projects/{project_id}/channels"
+    response = session.post(url, data=orjson.dumps(channel), headers=JSON_HEADERS)
     if not response:
+        if args.optimistic_create and is_duplicate_name_error(response):
+            find_channel.cache_clear()
+            channel_id = find_channel(space_id, project_id, branch_name)
+            if channel_id is not None:
+                sys.stderr.write("Found channel " + channel_id + "\n")
+                return channel_id
+        sys.stderr.write("Failed to create channel " + branch_name + ": " + response.text + "\n")
         raise OctopusApiError
-    json = response.json()
+    find_channel.cache_clear()
+    json = parse_json(response)
     sys.stderr.write("Created channel " + json["Id"] + "\n")
     return json["Id"]
 
@@ -301,17 +466,17 @@ def assign_target_by_name(space_id, environment_id, target_name):
 
     target_id = get_resource_id(space_id, "machines", target_name)
     if target_id is not None:
-        url = args.octopus_url + "/api/" + space_id + "/machines/" + target_id
-        get_response = get(url, headers=headers)
+        url = f"{base_url}/{space_id}/machines/{target_id}"
+        get_response = session.get(url)
 
         if not get_response:
             raise OctopusApiError
 
-        target = get_response.json()
+        target = parse_json(get_response)
 
         if environment_id not in target["EnvironmentIds"]:
             target["EnvironmentIds"].append(environment_id)
-            put_response = put(url, headers=headers, json=target)
+            put_response = session.put(url, data=orjson.dumps(target), headers=JSON_HEADERS)
 
             if not put_response:
                 raise OctopusApiError
@@ -329,8 +494,8 @@ def assign_target_by_role(space_id, environment_id, role_name):
     for target in targets:
         if environment_id not in target["EnvironmentIds"]:
             target["EnvironmentIds"].append(environment_id)
-            url = args.octopus_url + "/api/" + space_id + "/machines/" + target["Id"]
-            put_response = put(url, headers=headers, json=target)
+            url = f"{base_url}/{space_id}/machines/{target['Id']}"
+            put_response = session.put(url, data=orjson.dumps(target), headers=JSON_HEADERS)
 
             if not put_response:
                 raise OctopusApiError
@@ -351,8 +516,8 @@ def assign_target_by_role_and_environment(space_id, environment_id, role_name, e
         if existing_environment_id in target["EnvironmentIds"]:
             if environment_id not in target["EnvironmentIds"]:
                 target["EnvironmentIds"].append(environment_id)
-                url = args.octopus_url + "/api/" + space_id + "/machines/" + target["Id"]
-                put_response = put(url, headers=headers, json=target)
+                url = f"{base_url}/{space_id}/machines/{target['Id']}"
+                put_response = session.put(url, data=orjson.dumps(target), headers=JSON_HEADERS)
 
                 if not put_response:
                     raise OctopusApiError
@@ -362,33 +527,77 @@ def assign_target_by_role_and_environment(space_id, environment_id, role_name, e
                 sys.stderr.write("Environment " + environment_id + " already assigned to target " + target["Id"] + "\n")
 
 
+def get_task(space_id, task_id):
+    url = f"{base_url}/{space_id}/tasks/{task_id}"
+    response = session.get(url)
+    if not response:
+        raise OctopusApiError
+    return parse_json(response)
+
+
+def cancel_task(space_id, task_id):
+    url = f"{base_url}/{space_id}/tasks/{task_id}/cancel"
+    response = session.post(url)
+    if not response:
+        raise OctopusApiError
+
+
+# Returns True if the task had not completed and was cancelled
+def cancel_task_if_active(space_id, task_id):
+    task = get_task(space_id, task_id)
+    if task["IsCompleted"]:
+        return False
+
+    sys.stderr.write("Task " + task_id + " has not completed and will be cancelled\n")
+    cancel_task(space_id, task_id)
+    return True
+
+
+# Returns the IDs of the tasks that were cancelled
 def cancel_tasks(space_id, project_id, branch_name):
     if is_blank(space_id) or is_blank(project_id) or is_blank(branch_name):
-        return None
+        return set()
 
-    number_active_tasks = 0
     channel_id = find_channel(space_id, project_id, branch_name)
-    if channel_id is not None:
-        url = args.octopus_url + "/api/" + space_id + "/deployments?projects=" + project_id + "&channels=" + channel_id
-        releases = get(url, headers=headers)
-        json = releases.json()
-        sys.stderr.write("Found " + str(len(json["Items"])) + " deployments\n")
-
-        for deployment in json["Items"]:
+    if channel_id is None:
+        return set()
+
+    url = f"{base_url}/{space_id}/deployments?projects={project_id}&channels={channel_id}&take=100"
+    deployment_count = 0
+    task_futures = {}
+
+    with ThreadPoolExecutor(max_workers=MAX_CONNECTIONS) as executor:
+        # Each task is cancelled as soon as its own fetch shows it has not completed,
+        # while the remaining pages of deployments are still being read
+        for deployment in get_all_items(url):
+            deployment_count += 1
             task_id = deployment["TaskId"]
-            task_url = args.octopus_url + "/api/" + space_id + "/tasks/" + task_id
-            task_response = get(task_url, headers=headers)
-            task_json = task_response.json()
-
-            if not task_json["IsCompleted"]:
-                sys.stderr.write("Task " + task_id + " has not completed and will be cancelled\n")
-                number_active_tasks += 1
-                cancel_url = args.octopus_url + "/api/" + space_id + "/tasks/" + task_id + "/cancel"
-                response = post(cancel_url, headers=headers)
-                if not response:
-                    raise OctopusApiError
+            if task_id not in task_futures:
+                task_futures[task_id] = executor.submit(cancel_task_if_active, space_id, task_id)
+
+        sys.stderr.write("Found " + str(deployment_count) + " deployments\n")
+
+        active_task_ids = {task_id for task_id, future in task_futures.items() if future.result()}
+
+    return active_task_ids
+
 
-    return number_active_tasks
+# Returns the IDs of the tasks that have not yet completed
+def poll_tasks(space_id, task_ids):
+    if is_blank(space_id) or len(task_ids) == 0:
+        return set()
+
+    with ThreadPoolExecutor(max_workers=MAX_CONNECTIONS) as executor:
+        tasks = list(executor.map(lambda task_id: get_task(space_id, task_id), task_ids))
+
+    return {a["Id"] for a in tasks if not a["IsCompleted"]}
+
+
+def delete_release(space_id, release_id):
+    url = f"{base_url}/{space_id}/releases/{release_id}"
+    response = session.delete(url)
+    if not response:
+        raise OctopusApiError
 
 
 def delete_releases(space_id, project_id, branch_name):
@@ -397,15 +606,12 @@ def delete_releases(space_id, project_id, branch_name):
 
     channel_id = find_channel(space_id, project_id, branch_name)
     if channel_id is not None:
-        url = args.octopus_url + "/api/" + space_id + "/projects/" + project_id + "/releases"
-        releases = get(url, headers=headers)
-        json = releases.json()
-        channel_releases = [a for a in json["Items"] if a["ChannelId"] == channel_id]
-        for release in channel_releases:
-            url = args.octopus_url + "/api/" + space_id + "/releases/" + release["Id"]
-            response = delete(url, headers=headers)
-            if not response:
-                raise OctopusApiError
+        # Collect every page before deleting anything, as deleting releases shifts the later pages
+        url = f"{base_url}/{space_id}/channels/{channel_id}/releases?take=100"
+        release_ids = [a["Id"] for a in get_all_items(url)]
+
+        with ThreadPoolExecutor(max_workers=MAX_CONNECTIONS) as executor:
+            list(executor.map(lambda release_id: delete_release(space_id, release_id), release_ids))
 
 
 def delete_channel(space_id, project_id, branch_name):
@@ -414,10 +620,11 @@ def delete_channel(space_id, project_id, branch_name):
 
     channel_id = find_channel(space_id, project_id, branch_name)
     if channel_id is not None:
-        url = args.octopus_url + "/api/" + space_id + "/projects/" + project_id + "/channels/" + channel_id
-        response = delete(url, headers=headers)
+        url = f"{base_url}/{space_id}/projects/{project_id}/channels/{channel_id}"
+        response = session.delete(url)
         if not response:
             raise OctopusApiError
+        find_channel.cache_clear()
         sys.stderr.write("Deleted channel " + channel_id + "\n")
 
 
@@ -428,10 +635,11 @@ def delete_lifecycle(space_id, branch_name):
     lifecycle_id = get_resource_id(space_id, "lifecycles", branch_name)
 
     if lifecycle_id is not None:
-        url = args.octopus_url + "/api/" + space_id + "/lifecycles/" + lifecycle_id
-        response = delete(url, headers=headers)
+        url = f"{base_url}/{space_id}/lifecycles/{lifecycle_id}"
+        response = session.delete(url)
         if not response:
             raise OctopusApiError
+        get_resource_id.cache_clear()
         sys.stderr.write("Deleted lifecycle " + lifecycle_id + "\n")
 
 
@@ -442,10 +650,11 @@ def delete_environment(space_id, branch_name):
     environment_id = get_resource_id(space_id, "environments", branch_name)
 
     if environment_id is not None:
-        url = args.octopus_url + "/api/" + space_id + "/environments/" + environment_id
-        response = delete(url, headers=headers)
+        url = f"{base_url}/{space_id}/environments/{environment_id}"
+        response = session.delete(url)
         if not response:
             raise OctopusApiError
+        get_resource_id.cache_clear()
         sys.stderr.write("Deleted environment " + environment_id + "\n")
 
 
@@ -453,11 +662,12 @@ def delete_target(space_id, target_id):
     if is_blank(space_id) or is_blank(target_id):
         return
 
-    url = args.octopus_url + "/api/" + space_id + "/machines/" + target_id
-    response = delete(url, headers=headers)
+    url = f"{base_url}/{space_id}/machines/{target_id}"
+    response = session.delete(url)
 
     if not response:
         raise OctopusApiError
+    get_resource_id.cache_clear()
 
 
 def unassign_target_by_name(space_id, branch_name, target_name):
@@ -471,22 +681,22 @@ def unassign_target_by_name(space_id, branch_name, target_name):
 
     target_id = get_resource_id(space_id, "machines", target_name)
     if target_id is not None:
-        url = args.octopus_url + "/api/" + space_id + "/machines/" + target_id
-        get_response = get(url, headers=headers)
+        url = f"{base_url}/{space_id}/machines/{target_id}"
+        get_response = session.get(url)
 
         if not get_response:
             raise OctopusApiError
 
-        target = get_response.json()
+        target = parse_json(get_response)
 
-        if environment_id not in target["EnvironmentIds"]:
+        if environment_id in target["EnvironmentIds"]:
             target["EnvironmentIds"] = [a for a in target["EnvironmentIds"] if a != environment_id]
             if len(target["EnvironmentIds"]) == 0:
-                delete_target(target["Id"])
+                delete_target(space_id, target["Id"])
                 sys.stderr.write("Removed target " + target["Id"] + " because it was only assigned to the environment "
-                                 + environment_id)
+                                 + environment_id + "\n")
             else:
-                put_response = put(url, headers=headers, json=target)
+                put_response = session.put(url, data=orjson.dumps(target), headers=JSON_HEADERS)
 
                 if not put_response:
                     raise OctopusApiError
@@ -511,29 +721,29 @@ def unassign_target(space_id, branch_name):
             target["EnvironmentIds"] = [a for a in target["EnvironmentIds"] if a != environment_id]
 
             if len(target["EnvironmentIds"]) == 0:
-                delete_target(target["Id"])
+                delete_target(space_id, target["Id"])
                 sys.stderr.write("Removed target " + target["Id"] + " because it was only assigned to the environment "
-                                 + environment_id)
+                                 + environment_id + "\n")
             else:
-                url = args.octopus_url + "/api/" + space_id + "/machines/" + target["Id"]
-                put_response = put(url, headers=headers, json=target)
+                url = f"{base_url}/{space_id}/machines/{target['Id']}"
+                put_response = session.put(url, data=orjson.dumps(target), headers=JSON_HEADERS)
 
                 if not put_response:
                     raise OctopusApiError
 
-                sys.stderr.write("Removed environment " + environment_id + " to target " + target["Id"] + "\n")
+                sys.stderr.write("Removed environment " + environment_id + " from target " + target["Id"] + "\n")
         else:
             sys.stderr.write("Environment " + environment_id + " not assigned to target " + target["Id"] + "\n")
 
 
-@retry_on_communication_error
-def create_feature_branch():
-    space_id = get_space_id(args.octopus_space)
-    project_id = get_resource_id(space_id, "projects", args.octopus_project)
-    environment_id = create_environment(space_id, args.branch_name)
-    lifecycle_id = create_lifecycle(space_id, environment_id, args.branch_name)
-    create_channel(space_id, project_id, lifecycle_id, args.deployment_step_name, args.deployment_package_name,
-                   args.branch_name)
+def clear_lookup_caches():
+    # Each retry must see resources that a failed attempt created or deleted
+    get_space_id.cache_clear()
+    get_resource_id.cache_clear()
+    find_channel.cache_clear()
+
+
+def assign_targets(space_id, environment_id):
     if is_blank(args.target_name):
         if is_blank(args.target_environment):
             assign_target_by_role(space_id, environment_id, args.target_role)
@@ -543,35 +753,62 @@ def create_feature_branch():
         assign_target_by_name(space_id, environment_id, args.target_name)
 
 
+def cancel_and_wait_for_tasks(space_id, project_id, branch_name):
+    # Only the cancelled tasks need to be polled, backing off from 1 second up to 10 seconds between checks
+    active_task_ids = cancel_tasks(space_id, project_id, branch_name)
+    attempt = 0
+    while len(active_task_ids) != 0:
+        time.sleep(min(10, 2 ** attempt))
+        active_task_ids = poll_tasks(space_id, active_task_ids)
+        attempt += 1
+
+
 @retry_on_communication_error
-def delete_feature_branch():
-    space_id = get_space_id(args.octopus_space)
-    project_id = get_resource_id(space_id, "projects", args.octopus_project)
+def create_feature_branch():
+    clear_lookup_caches()
+    pipeline = Pipeline()
+    pipeline.add("space", get_space_id, args.octopus_space)
+    pipeline.add("project", get_resource_id, Result("space"), "projects", args.octopus_project)
+    pipeline.add("environment", create_environment, Result("space"), args.branch_name)
+    pipeline.add("lifecycle", create_lifecycle, Result("space"), Result("environment"), args.branch_name)
+    pipeline.add("channel", create_channel, Result("space"), Result("project"), Result("lifecycle"),
+                 args.deployment_step_name, args.deployment_package_name, args.branch_name)
+    pipeline.add("targets", assign_targets, Result("space"), Result("environment"))
+    pipeline.run()
 
-    while True:
-        tasks = cancel_tasks(space_id, project_id, args.branch_name)
-        if tasks == 0:
-            break
-        time.sleep(10)
 
-    delete_releases(space_id, project_id, args.branch_name)
-    delete_channel(space_id, project_id, args.branch_name)
-    delete_lifecycle(space_id, args.branch_name)
-    unassign_target(space_id, args.branch_name)
-    delete_environment(space_id, args.branch_name)
+@retry_on_communication_error
+def delete_feature_branch():
+    clear_lookup_caches()
+    pipeline = Pipeline()
+    pipeline.add("space", get_space_id, args.octopus_space)
+    pipeline.add("project", get_resource_id, Result("space"), "projects", args.octopus_project)
+    pipeline.add("tasks", cancel_and_wait_for_tasks, Result("space"), Result("project"), args.branch_name)
+    pipeline.add("releases", delete_releases, Result("space"), Result("project"), args.branch_name, after=["tasks"])
+    pipeline.add("channel", delete_channel, Result("space"), Result("project"), args.branch_name, after=["releases"])
+    pipeline.add("lifecycle", delete_lifecycle, Result("space"), args.branch_name, after=["channel"])
+    pipeline.add("targets", unassign_target, Result("space"), args.branch_name, after=["tasks"])
+    pipeline.add("environment", delete_environment, Result("space"), args.branch_name, after=["lifecycle", "targets"])
+    pipeline.run()
 
 
 def main():
     if args.branch_name in IGNORED_BRANCHES:
         return
 
-    if args.action == 'create':
-        create_feature_branch()
+    try:
+        if args.action == 'create':
+            create_feature_branch()
 
-    if args.action == 'delete':
-        delete_feature_branch()
+        if args.action == 'delete':
+            delete_feature_branch()
+    finally:
+        save_id_cache()
 
 
 args = parse_args()
-headers = build_headers()
+server_url = args.octopus_url.rstrip('/')
+base_url = f"{server_url}/api"
+session = build_session()
+id_cache = load_id_cache()
 main()